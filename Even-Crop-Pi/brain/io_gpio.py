@@ -7,6 +7,13 @@ unchanged on a dev laptop (mock) or on a Raspberry Pi (real).
 It AUTO-DETECTS environment and falls back to a safe mock if RPi libs are
 missing. You can also force mock by setting EVENCROP_GPIO=mock.
 
+Inputs (switches + flow meter) are read through libgpiod when available:
+one kernel line-request, one event FD watched by the asyncio loop, edges
+debounced in the kernel. Without gpiod we fall back to RPi.GPIO callbacks.
+Flow pulses are counted in batches (one read per wakeup, many edges), or
+straight from a hardware counter node if EVENCROP_PULSE_COUNTER points at
+one (sysfs/IIO file holding a free-running 32-bit count).
+
 Features used by the Brain:
 - configure mapping for:
     • FlowMeter input (count pulses)
@@ -27,7 +34,9 @@ from __future__ import annotations
 import os
 import time
 import asyncio
-from typing import Dict, Optional, Callable, Any, List
+import heapq
+from datetime import timedelta
+from typing import Dict, Optional, Callable, Any, List, Tuple
 
 # -----------------------------------------------------------------------------
 # Backend selection
@@ -42,6 +51,25 @@ try:
 except Exception:
     _HAVE_RPI = False
 
+try:
+    if _FORCE != "mock":
+        import gpiod  # type: ignore
+        from gpiod.line import Bias, Edge  # type: ignore
+        _HAVE_GPIOD = True
+    else:
+        _HAVE_GPIOD = False
+except Exception:
+    _HAVE_GPIOD = False
+
+# Header pins live on gpiochip0 (BCM number == line offset)
+_GPIOCHIP = os.environ.get("EVENCROP_GPIOCHIP", "/dev/gpiochip0")
+# Optional hardware pulse counter (e.g. /sys/bus/iio/devices/iio:device0/in_count0_raw)
+_PULSE_COUNTER = os.environ.get("EVENCROP_PULSE_COUNTER", "").strip() or None
+
+
+def _mono_ms() -> int:
+    return time.monotonic_ns() // 1_000_000
+
 
 # -----------------------------------------------------------------------------
 # Base interface
@@ -54,13 +82,20 @@ class BaseGPIO:
             "M1": None, "M2": None, "M3": None,  # momentary inputs
             "units": {}       # {unit_id: pin}
         }
-        self._loop = asyncio.get_event_loop()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None  # bound in start()
         self._pulse_count = 0
         self._switch_state: Dict[str, bool] = {"M1": False, "M2": False, "M3": False}
         self._tasks: List[asyncio.Task] = []
 
     # ----- lifecycle -----
-    async def start(self): ...
+    async def start(self):
+        # grab the loop we actually run on (so make_gpio() works from sync code)
+        self._loop = asyncio.get_running_loop()
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        # before start(): whatever loop we're being called on (RuntimeError if none is running)
+        return self._loop or asyncio.get_running_loop()
+
     async def stop(self):
         # cancel all pending output tasks
         for t in list(self._tasks):
@@ -93,7 +128,7 @@ class BaseGPIO:
         # Default: fire a mock task; subclasses override for real GPIO
         async def _job():
             await asyncio.sleep(ms / 1000.0)
-        task = self._loop.create_task(_job())
+        task = self._get_loop().create_task(_job())
         self._tasks.append(task)
         def _done(_): 
             try:
@@ -112,8 +147,8 @@ class BaseGPIO:
     def _simulate_switch_pulse(self, name: str):
         """Simulate a brief press on M1/M2/M3 (for tests)."""
         self._switch_state[name] = True
-        # auto release shortly
-        self._loop.call_later(0.05, lambda: self._switch_state.__setitem__(name, False))
+        # auto release shortly (called on the loop thread, so a plain timer will do)
+        self._get_loop().call_later(0.05, self._switch_state.__setitem__, name, False)
 
     def _simulate_flow_pulse(self, n: int = 1):
         self._pulse_count += int(n)
@@ -126,14 +161,22 @@ class MockGPIO(BaseGPIO):
     def __init__(self):
         super().__init__()
         self._running = False
+        self.open_units: set = set()   # unit ids currently "open" (for tests / inspection)
 
     async def start(self):
+        await super().start()
         self._running = True
         # no hardware; nothing to set up
 
     async def stop(self):
         await super().stop()
         self._running = False
+        self.open_units.clear()
+
+    async def open_unit_for(self, unit_id: int, ms: int):
+        # no hardware: mark open and let a plain loop timer close it (no Task/coroutine per fire)
+        self.open_units.add(unit_id)
+        self._get_loop().call_later(max(0, ms) / 1000.0, self.open_units.discard, unit_id)
 
 
 # -----------------------------------------------------------------------------
@@ -144,11 +187,59 @@ class RPiGPIO(BaseGPIO):
         super().__init__()
         self._chan_setup = False
         self._flow_pin = None
+        self._req = None                      # gpiod line request (switches)
+        self._flow_req = None                 # gpiod line request (flow meter)
+        self._line_names: Dict[int, str] = {} # line offset -> "M1".."M3"
+        self._pc_last: Optional[int] = None   # last hardware counter reading
+        # timer wheel for unit outputs: heap of (deadline_ms, pin, level), one runner task
+        self._wheel: List[Tuple[int, int, int]] = []
+        self._wheel_wake: Optional[asyncio.Event] = None
 
     async def start(self):
+        await super().start()
         # BCM numbering
         RGPIO.setmode(RGPIO.BCM)
         # Inputs
+        if _PULSE_COUNTER:
+            self._pc_last = self._read_counter()
+        if _HAVE_GPIOD:
+            self._start_edge_reader()
+        else:
+            self._start_edge_callbacks()
+        # Outputs
+        bz = self.mapping.get("buzzer")
+        if bz is not None:
+            RGPIO.setup(bz, RGPIO.OUT, initial=RGPIO.LOW)
+        for uid, pin in self.mapping["units"].items():
+            RGPIO.setup(pin, RGPIO.OUT, initial=RGPIO.LOW)
+        self._wheel_wake = asyncio.Event()
+        self._tasks.append(self._loop.create_task(self._wheel_runner()))
+
+    def _start_edge_reader(self):
+        """Request input lines from the kernel and watch their event FDs on the loop."""
+        self._line_names = {}
+        for name in ("M1", "M2", "M3"):
+            p = self.mapping.get(name)
+            if p is not None:
+                self._line_names[p] = name
+        # Falling edge = pressed / pulse; debounce in the kernel (10 ms switches, 1 ms flow)
+        if self._line_names:
+            settings = gpiod.LineSettings(edge_detection=Edge.FALLING, bias=Bias.PULL_UP,
+                                          debounce_period=timedelta(milliseconds=10))
+            self._req = gpiod.request_lines(_GPIOCHIP, consumer="even-crop",
+                                            config={tuple(self._line_names): settings})
+            self._loop.add_reader(self._req.fd, self._drain_edges)
+        # Flow gets its own request so a batch of events is all pulses (count = len)
+        self._flow_pin = self.mapping.get("flow")
+        if self._flow_pin is not None and not _PULSE_COUNTER:
+            settings = gpiod.LineSettings(edge_detection=Edge.FALLING, bias=Bias.PULL_UP,
+                                          debounce_period=timedelta(milliseconds=1))
+            self._flow_req = gpiod.request_lines(_GPIOCHIP, consumer="even-crop-flow",
+                                                 config={self._flow_pin: settings})
+            self._loop.add_reader(self._flow_req.fd, self._drain_flow)
+
+    def _start_edge_callbacks(self):
+        """Legacy path: RPi.GPIO edge callbacks (one worker thread per channel)."""
         for name in ("M1", "M2", "M3"):
             p = self.mapping.get(name)
             if p is not None:
@@ -157,30 +248,78 @@ class RPiGPIO(BaseGPIO):
                 RGPIO.add_event_detect(p, RGPIO.FALLING, callback=self._mk_switch_cb(name), bouncetime=10)
         # Flow meter input (count pulses)
         self._flow_pin = self.mapping.get("flow")
-        if self._flow_pin is not None:
+        if self._flow_pin is not None and not _PULSE_COUNTER:
             RGPIO.setup(self._flow_pin, RGPIO.IN, pull_up_down=RGPIO.PUD_UP)
             RGPIO.add_event_detect(self._flow_pin, RGPIO.FALLING, callback=self._flow_cb, bouncetime=1)
-        # Outputs
-        bz = self.mapping.get("buzzer")
-        if bz is not None:
-            RGPIO.setup(bz, RGPIO.OUT, initial=RGPIO.LOW)
-        for uid, pin in self.mapping["units"].items():
-            RGPIO.setup(pin, RGPIO.OUT, initial=RGPIO.LOW)
 
     async def stop(self):
         await super().stop()
+        for req in (self._req, self._flow_req):
+            if req is None:
+                continue
+            try:
+                self._loop.remove_reader(req.fd)
+                req.release()
+            except Exception:
+                pass
+        self._req = self._flow_req = None
+        # the runner is gone: close every valve still waiting for its LOW edge ourselves
+        for pin in {pin for _, pin, _ in self._wheel}:
+            try:
+                RGPIO.output(pin, RGPIO.LOW)
+            except Exception:
+                pass
+        self._wheel.clear()
         try:
             RGPIO.cleanup()
         except Exception:
             pass
 
-    # ---- callbacks ----
+    # ---- edge reader (loop thread) ----
+    def _drain_edges(self):
+        """FD readable: drain every queued edge in one pass, no extra threads involved."""
+        req = self._req
+        if req is None:
+            return
+        while req.wait_edge_events(0):
+            for ev in req.read_edge_events():
+                name = self._line_names.get(ev.line_offset)
+                if name:
+                    self._switch_state[name] = True
+                    # release after 50 ms
+                    self._loop.call_later(0.05, self._switch_state.__setitem__, name, False)
+
+    def _drain_flow(self):
+        """Flow FD readable: count pulses per batch of events, not per edge."""
+        req = self._flow_req
+        if req is None:
+            return
+        while req.wait_edge_events(0):
+            self._pulse_count += len(req.read_edge_events(max_events=64))
+
+    # ---- hardware pulse counter ----
+    @staticmethod
+    def _read_counter() -> int:
+        with open(_PULSE_COUNTER, "rb") as f:
+            return int(f.read().strip() or 0)
+
+    def get_pulses_and_reset(self) -> int:
+        if self._pc_last is None:
+            return super().get_pulses_and_reset()
+        # free-running 32-bit counter: O(1) per poll whatever the pulse rate
+        now = self._read_counter()
+        c = (now - self._pc_last) & 0xFFFFFFFF
+        self._pc_last = now
+        return c
+
+    # ---- callbacks (legacy RPi.GPIO path) ----
     def _mk_switch_cb(self, name: str) -> Callable[[int], None]:
         def _cb(channel_pin: int):
             # Debounced falling edge => pressed True followed by auto release
             self._switch_state[name] = True
-            # release after 50 ms
-            self._loop.call_later(0.05, lambda: self._switch_state.__setitem__(name, False))
+            # release after 50 ms; we're on an RPi.GPIO thread, so hand the timer to the loop
+            self._loop.call_soon_threadsafe(self._loop.call_later, 0.05,
+                                            self._switch_state.__setitem__, name, False)
         return _cb
 
     def _flow_cb(self, channel_pin: int):
@@ -190,13 +329,29 @@ class RPiGPIO(BaseGPIO):
     async def open_unit_for(self, unit_id: int, ms: int):
         pin = self.mapping["units"].get(unit_id)
         if pin is None:  # silently ignore if not mapped
-            await asyncio.sleep(ms / 1000.0)
             return
+        # open now, queue the close on the wheel (returns immediately)
         RGPIO.output(pin, RGPIO.HIGH)
-        try:
-            await asyncio.sleep(max(0, ms) / 1000.0)
-        finally:
-            RGPIO.output(pin, RGPIO.LOW)
+        heapq.heappush(self._wheel, (_mono_ms() + max(0, int(ms)), pin, 0))
+        if self._wheel_wake is not None:
+            self._wheel_wake.set()
+
+    async def _wheel_runner(self):
+        """Single coroutine driving every pending output edge: one wakeup per due deadline."""
+        wheel = self._wheel
+        wake = self._wheel_wake
+        while True:
+            wake.clear()
+            now = _mono_ms()
+            while wheel and wheel[0][0] <= now:
+                _, pin, level = heapq.heappop(wheel)
+                RGPIO.output(pin, RGPIO.HIGH if level else RGPIO.LOW)
+            try:
+                # sleep until the next deadline, or until open_unit_for pushes an earlier one
+                timeout = (wheel[0][0] - now) / 1000.0 if wheel else None
+                await asyncio.wait_for(wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
 
     async def buzzer(self, on: bool, ms: Optional[int] = None):
         pin = self.mapping.get("buzzer")
@@ -238,7 +393,8 @@ if __name__ == "__main__":
         print("Buzz 200ms")
         await gpio.buzzer(True, 200)
         print("Open unit 1 for 500ms")
-        await gpio.open_unit_for(1, 500)
+        await gpio.open_unit_for(1, 500)   # returns at once; the close is scheduled
+        await asyncio.sleep(0.5)
         print("Sim pulses (mock only)")
         gpio._simulate_flow_pulse(5)
         print("Pulses:", gpio.get_pulses_and_reset())
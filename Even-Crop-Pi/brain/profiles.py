@@ -12,10 +12,26 @@ you can wire them behind HTTP endpoints later if desired.
 """
 from __future__ import annotations
 
+import copy
 import json
+import os
+import re
 from dataclasses import dataclass, asdict
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import orjson  # type: ignore
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+
+    _loads = orjson.loads
+except Exception:
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, indent=2).encode("utf-8")
+
+    _loads = json.loads
 
 ROOT = Path(__file__).resolve().parents[1]
 DATA_DIR = ROOT / "data"
@@ -31,57 +47,87 @@ PROFILE_KEYS = [
     "gpio",
 ]
 
+# Per-unit configuration kept in a profile (volatile readings like status/deviation are not)
+_UNIT_WHITELIST = frozenset((
+    "id", "enabled", "group", "momentary", "offset", "perDelayMs",
+    "mode", "pulsesPerCycle", "pulsesPerLiter", "msPerMl",
+))
+
+# Parsed profiles keyed by path -> ((ino, mtime_ns, size), data); list keyed by dir mtime.
+# ino is in the key because every save is an os.replace (new inode), which still tells
+# a re-save apart on coarse-timestamp media (FAT/exFAT: 2 s) when mtime and size match.
+_PROF_CACHE: Dict[Path, Tuple[Tuple[int, int, int], Dict[str, Any]]] = {}
+_LIST_CACHE: Optional[Tuple[int, List[str]]] = None
+
+_SANITIZE_RE = re.compile(r"[^A-Za-z0-9\-_ .]+")
+
 # ----- utilities -----
 
 def _strip_runtime(state: Dict[str, Any]) -> Dict[str, Any]:
-    """Return only the configuration parts of state."""
-    out = {}
-    for k in PROFILE_KEYS:
-        if k in state:
-            out[k] = state[k]
+    """Return only the configuration parts of state (the live state is not modified)."""
+    out = {k: state[k] for k in PROFILE_KEYS if k in state}
     # Ensure units do not carry volatile readings
-    for u in out.get("units", []):
-        u.pop("lastDeliveredMl", None)
-        u.pop("deviation", None)
-        u.pop("status", None)
+    if "units" in out:
+        out["units"] = [{k: v for k, v in u.items() if k in _UNIT_WHITELIST} for u in out["units"]]
     return out
 
 def _sanitize_name(name: str) -> str:
-    safe = "".join(c for c in name if c.isalnum() or c in ("-", "_", " ", ".")).strip()
-    return safe or "profile"
+    """Keep ASCII letters/digits and '-', '_', ' ', '.'; anything else (incl. non-ASCII) is dropped."""
+    return _SANITIZE_RE.sub("", name).strip() or "profile"
 
 def profile_path(name: str) -> Path:
     return PROF_DIR / f"{_sanitize_name(name)}.json"
 
+def _stat_key(st: os.stat_result) -> Tuple[int, int, int]:
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def _shape_guards(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Basic shape guards for a loaded profile."""
+    data.setdefault("targetMl", 100)
+    data.setdefault("deliveryMode", "flow")
+    data.setdefault("momentary", {"M1":{"enabled":True,"offset":0},
+                                  "M2":{"enabled":False,"offset":0},
+                                  "M3":{"enabled":False,"offset":0}})
+    data.setdefault("autoDelay", {"enabled":True,"manualMs":500,"geomLeadMs":0,"currentMs":500})
+    data.setdefault("units", [])
+    data.setdefault("gpio", {})
+    return data
+
 # ----- public API -----
 
 def list_profiles() -> List[str]:
     """Return list of profile basenames (without extension)."""
-    out: List[str] = []
-    for p in sorted(PROF_DIR.glob("*.json")):
-        out.append(p.stem)
-    return out
+    global _LIST_CACHE
+    mtime = PROF_DIR.stat().st_mtime_ns
+    if _LIST_CACHE is None or _LIST_CACHE[0] != mtime:
+        _LIST_CACHE = (mtime, [p.stem for p in sorted(PROF_DIR.glob("*.json"))])
+    return list(_LIST_CACHE[1])
 
 def save_profile(name: str, state: Dict[str, Any]) -> Path:
     """Save configuration subset to a profile file. Returns path."""
     p = profile_path(name)
-    p.write_text(json.dumps(_strip_runtime(state), indent=2), encoding="utf-8")
+    # write aside then rename: a crash never leaves a half-written profile
+    tmp = p.with_suffix(".json.tmp")
+    raw = _dumps(_strip_runtime(state))
+    tmp.write_bytes(raw)
+    os.replace(tmp, p)
+    # we know exactly what's on disk now: refresh instead of trusting timestamps
+    global _LIST_CACHE
+    _PROF_CACHE[p] = (_stat_key(p.stat()), _shape_guards(_loads(raw)))
+    _LIST_CACHE = None
     return p
 
 def load_profile(name: str) -> Dict[str, Any]:
     """Load a profile and return its dict. Raises FileNotFoundError if missing."""
     p = profile_path(name)
-    data = json.loads(p.read_text(encoding="utf-8"))
-    # Basic shape guards
-    data.setdefault("targetMl", 100)
-    data.setdefault("deliveryMode", "flow")
-    data.setdefault("momentary", {"M1":{"enabled":True,"offset":0},
-                                  "M2":{"enabled":False,"offset":0},
-                                  "M3":{"enabled":False,"offset":0}})
-    data.setdefault("autoDelay", {"enabled":True,"manualMs":500,"geomLeadMs":0,"currentMs":500})
-    data.setdefault("units", [])
-    data.setdefault("gpio", {})
-    return data
+    st = p.stat()
+    key = _stat_key(st)
+    hit = _PROF_CACHE.get(p)
+    if hit and hit[0] == key:
+        return copy.deepcopy(hit[1])
+    data = _shape_guards(_loads(p.read_bytes()))
+    _PROF_CACHE[p] = (key, data)
+    return copy.deepcopy(data)
 
 def apply_profile(state: Dict[str, Any], prof: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -101,10 +147,14 @@ def apply_profile(state: Dict[str, Any], prof: Dict[str, Any]) -> Dict[str, Any]
 def delete_profile(name: str) -> bool:
     """Delete a profile; returns True if removed."""
     p = profile_path(name)
-    if p.exists():
-        p.unlink()
-        return True
-    return False
+    try:
+        p.unlink()                # one syscall, no exists()/unlink() race
+    except FileNotFoundError:
+        return False
+    global _LIST_CACHE
+    _PROF_CACHE.pop(p, None)
+    _LIST_CACHE = None
+    return True
 
 # ----- example CLI -----
 if __name__ == "__main__":
@@ -127,8 +177,9 @@ if __name__ == "__main__":
 
     if args.cmd == "save":
         if not args.name: ap.error("--name is required for save")
+        from state_store import read_state   # state.json + pending patch log (see state_store)
         src = Path(args.state) if args.state else (DATA_DIR / "state.json")
-        st = json.loads(src.read_text(encoding="utf-8"))
+        st = read_state(src)
         p = save_profile(args.name, st)
         print("saved:", p)
         sys.exit(0)
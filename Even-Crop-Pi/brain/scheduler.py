@@ -15,12 +15,13 @@ fire_time(unit) = press_time_ms
 """
 
 from dataclasses import dataclass
+from operator import itemgetter
 from typing import Dict, List, Literal, Tuple, Callable, Optional
 import time
 
 Pattern = Literal["diamond", "diagonal", "line"]
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class UnitState:
     id: int
     enabled: bool
@@ -32,25 +33,26 @@ class UnitState:
     pulsesPerCycle: int
     msPerMl: float
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class MomentaryCfg:
     enabled: bool
     offset: int                 # 0..100 % mapped to 0..1000 ms
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class AutoDelay:
     enabled: bool
     manualMs: int
     geomLeadMs: int
     currentMs: int
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class BrainStateView:
     targetMl: int
     deliveryMode: Literal["flow","timed"]
     autoDelay: AutoDelay
     momentary: Dict[str, MomentaryCfg]
     units: List[UnitState]
+    version: Optional[int] = None   # bumped by the producer on ANY config change; None = don't memoize
 
 # ---- helpers ----
 
@@ -64,25 +66,39 @@ def _momentary_ms(m: Dict[str, MomentaryCfg], name: str) -> int:
     except Exception:
         return 0
 
-def _pattern_base_ms(pattern: Pattern, unit: UnitState, auto: AutoDelay, diagonal_step_ms: int = 80) -> int:
-    """
-    Base delay set by the pattern *before* momentary and per-unit offsets.
+# Base delay set by the pattern *before* momentary and per-unit offsets:
+#   - diamond: A = 0; B = current B delay (auto.currentMs)
+#   - diagonal: unit index order 1..N fires with a fixed step between units (80 ms default)
+#   - line: all 0
+def _diamond_base(unit: UnitState, auto: AutoDelay) -> int:
+    return 0 if unit.group == "A" else max(0, int(auto.currentMs))
 
-    - diamond: A = 0; B = current B delay (auto.currentMs)
-    - diagonal: Unit index order 1..N fires with fixed step between units
-                (simple default: 80 ms per step; caller can change)
-    - line: all 0
-    """
-    if pattern == "diamond":
-        return 0 if unit.group == "A" else max(0, int(auto.currentMs))
-    if pattern == "diagonal":
-        # Use unit.id ordering for a simple stagger; adjust as needed
-        return max(0, (unit.id - 1) * int(diagonal_step_ms))
+def _diagonal_base(unit: UnitState, auto: AutoDelay, diagonal_step_ms: int = 80) -> int:
+    # Use unit.id ordering for a simple stagger; adjust as needed
+    return max(0, (unit.id - 1) * int(diagonal_step_ms))
+
+def _line_base(unit: UnitState, auto: AutoDelay) -> int:
     # line (simultaneous)
     return 0
 
-def _inherit_mode(global_mode: str, unit_mode: str) -> str:
-    return unit_mode if unit_mode in ("flow","timed") else global_mode
+# pattern -> base function; resolved once in Scheduler.set_pattern, not per unit
+_BASE_FUNCS: Dict[str, Callable[[UnitState, AutoDelay], int]] = {
+    "diamond": _diamond_base,
+    "diagonal": _diagonal_base,
+    "line": _line_base,
+}
+
+_NO_FLOOR = -(1 << 30)
+
+def _per_floors(pattern: Pattern, auto: AutoDelay) -> Dict[str, int]:
+    """
+    Lowest allowed per-unit delay by group for this cycle.
+    Diamond rule: B cannot advance earlier than A (not negative beyond -BΔ),
+    A never goes negative. Other patterns don't clamp.
+    """
+    if pattern == "diamond":
+        return {"A": 0, "B": -max(0, int(auto.currentMs))}
+    return {}
 
 # ---- public scheduler ----
 
@@ -97,6 +113,12 @@ class Scheduler:
     use:
       plan = sched.plan_cycle(now_ms=ms(), pressed_m="M1")
       -> list of schedule entries for enabled/non-tramlined units
+      (now_ms and start_ms are on the monotonic clock, time.monotonic_ns() // 1e6)
+
+    Unit fields are kept as a column table (one tuple per field) that is
+    only rebuilt when state_fn() hands over a different units list, so
+    treat a snapshot's units list as immutable and supply a new list when
+    unit config changes. Same for the momentary dict (ms lookup table).
 
     Each entry: (unit_id, start_ms, duration_ms, mode_dict)
       - duration_ms for "timed" is computed from target and msPerMl
@@ -111,41 +133,53 @@ class Scheduler:
         self._state_fn = state_fn
         self._tram_off = tramline_off_fn
         self._pattern: Pattern = pattern
+        self._base_fn = _BASE_FUNCS.get(pattern, _line_base)
+        # per-unit column table (SoA), synced from st.units by _rebuild_arrays
+        self._arrays_src: Optional[List[UnitState]] = None
+        self._units: Tuple[UnitState, ...] = ()
+        self._ids: Tuple[int, ...] = ()
+        self._enabled: Tuple[bool, ...] = ()
+        self._per: Tuple[int, ...] = ()
+        self._mode: Tuple[str, ...] = ()
+        self._pulses: Tuple[int, ...] = ()
+        self._ms_per_ml: Tuple[float, ...] = ()
+        # momentary name -> offset ms, rebuilt only when st.momentary changes
+        self._mom_lut_src: Optional[Dict[str, MomentaryCfg]] = None
+        self._mom_lut: Dict[Optional[str], int] = {}
+        # last plan, reused (time-shifted) while (version, pattern, tramline) is unchanged
+        self._cached_plan_key: Optional[Tuple] = None
+        self._cached_plan: List[Tuple[int,int,Optional[int],Dict]] = []
+        self._cached_t0 = 0
 
     def set_pattern(self, p: Pattern):
         self._pattern = p
+        self._base_fn = _BASE_FUNCS.get(p, _line_base)
 
     @staticmethod
     def _now_ms() -> int:
-        return int(time.time() * 1000)
-
-    def _unit_fire_ms(self, base_ms: int, unit: UnitState, st: BrainStateView) -> int:
-        base = _pattern_base_ms(self._pattern, unit, st.autoDelay)
-        mom = _momentary_ms(st.momentary, unit.momentary)
-        per = int(unit.perDelayMs or 0)
-
-        # Diamond rule: B cannot advance earlier than A (not negative beyond -BΔ)
-        # Assume UI already clamps perDelayMs, but re-safety here:
-        if self._pattern == "diamond" and unit.group == "B":
-            min_neg = -max(0, int(st.autoDelay.currentMs))
-            if per < min_neg: per = min_neg
-        if self._pattern == "diamond" and unit.group == "A":
-            if per < 0: per = 0
-
-        return base_ms + base + mom + per
-
-    def _duration_and_mode(self, unit: UnitState, st: BrainStateView) -> Tuple[Optional[int], Dict]:
-        target = max(1, int(getattr(st, "targetMl", 100)))
-        mode = _inherit_mode(st.deliveryMode, unit.mode)
-
-        if mode == "timed":
-            ms_per_ml = max(0.1, float(unit.msPerMl or 5.0))
-            dur = int(round(target * ms_per_ml))
-            return dur, {"mode":"timed", "ms_per_ml": ms_per_ml, "target_ml": target}
-        else:
-            # flow: hardware layer will count pulses; we provide desired pulses/cycle
-            pulses = max(1, int(unit.pulsesPerCycle or 100))
-            return None, {"mode":"flow", "pulses": pulses, "target_ml": target}
+        # monotonic: immune to NTP steps/slew, and no float multiply
+        return time.monotonic_ns() // 1_000_000
+
+    def _rebuild_arrays(self, st: BrainStateView):
+        """Sync the column table with st.units (no-op while it's the same list)."""
+        units = st.units
+        if units is self._arrays_src:
+            return
+        self._arrays_src = units      # keep a ref so the identity check can't be fooled by id reuse
+        self._units = tuple(units)
+        self._ids = tuple(u.id for u in units)
+        self._enabled = tuple(bool(u.enabled) for u in units)
+        self._per = tuple(int(u.perDelayMs or 0) for u in units)
+        self._mode = tuple(u.mode for u in units)
+        self._pulses = tuple(max(1, int(u.pulsesPerCycle or 100)) for u in units)
+        self._ms_per_ml = tuple(max(0.1, float(u.msPerMl or 5.0)) for u in units)
+
+    def _momentary_lut(self, st: BrainStateView) -> Dict[Optional[str], int]:
+        mom = st.momentary
+        if mom is not self._mom_lut_src:
+            self._mom_lut_src = mom
+            self._mom_lut = {n: _momentary_ms(mom, n) for n in mom}
+        return self._mom_lut
 
     def plan_cycle(self, now_ms: Optional[int] = None, pressed_m: Optional[str] = None) -> List[Tuple[int,int,Optional[int],Dict]]:
         """
@@ -153,26 +187,59 @@ class Scheduler:
           (unit_id, start_ms, duration_ms, mode_dict)
 
         Only includes units that are enabled and not temporarily OFF (tramline).
+        pressed_m is accepted for callers but not used to filter: a press is
+        treated as global, each unit's own momentary only sets its offset.
+
+        If the snapshot carries a version, an unchanged (version, pattern,
+        tramline) returns the previous plan shifted to the new t0. Every call
+        returns a new list with its own mode dicts, so it's the caller's to mutate.
         """
         st = self._state_fn()
         t0 = now_ms if now_ms is not None else self._now_ms()
+        self._rebuild_arrays(st)
+        tram = self._tram_off
+
+        key = None
+        if st.version is not None:
+            key = (st.version, self._pattern, tuple(tram(uid) for uid in self._ids))
+            if key == self._cached_plan_key:
+                dt = t0 - self._cached_t0
+                # fresh list and mode dicts: callers may consume/edit what they get
+                return [(uid, start + dt, dur, dict(info)) for uid, start, dur, info in self._cached_plan]
+
+        # cycle invariants bound once as locals (no attribute chains in the loop)
+        pattern = self._pattern
+        base_fn = self._base_fn
+        auto = st.autoDelay
+        mom_get = self._momentary_lut(st).get
+        dmode = st.deliveryMode
+        target = max(1, int(getattr(st, "targetMl", 100)))
+        floors_get = _per_floors(pattern, auto).get
         out: List[Tuple[int,int,Optional[int],Dict]] = []
+        append = out.append
 
-        for u in st.units:
-            if not u.enabled:
+        for u, uid, on, per, mode, pulses, ms_per_ml in zip(
+                self._units, self._ids, self._enabled, self._per,
+                self._mode, self._pulses, self._ms_per_ml):
+            if not on or tram(uid):
                 continue
-            if self._tram_off(u.id):
-                continue
-            # If a specific momentary pressed filter is required, skip non-matching units:
-            if pressed_m and u.momentary and u.momentary != pressed_m:
-                # If the press is physically per-row, you may want this filter true;
-                # if press is global/virtual, ignore this condition.
-                pass
-
-            start_ms = self._unit_fire_ms(t0, u, st)
-            duration_ms, mode_info = self._duration_and_mode(u, st)
-            out.append((u.id, start_ms, duration_ms, mode_info))
+            # per-unit delay: UI already clamps it, the pattern floor is the re-safety here
+            start_ms = (t0 + base_fn(u, auto)
+                        + mom_get(u.momentary, 0)
+                        + max(floors_get(u.group, _NO_FLOOR), per))
+
+            if (mode if mode in ("flow", "timed") else dmode) == "timed":
+                append((uid, start_ms, int(round(target * ms_per_ml)),
+                        {"mode":"timed", "ms_per_ml": ms_per_ml, "target_ml": target}))
+            else:
+                # flow: hardware layer will count pulses; we provide desired pulses/cycle
+                append((uid, start_ms, None,
+                        {"mode":"flow", "pulses": pulses, "target_ml": target}))
 
         # stable order by start time then unit id
-        out.sort(key=lambda e: (e[1], e[0]))
+        out.sort(key=itemgetter(1, 0))
+        if key is not None:
+            # cache private copies so consuming the returned plan can't touch them
+            self._cached_plan = [(uid, start, dur, dict(info)) for uid, start, dur, info in out]
+            self._cached_plan_key, self._cached_t0 = key, t0
         return out
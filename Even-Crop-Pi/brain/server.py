@@ -17,18 +17,57 @@ For production, you`ll likely split IO, scheduler, and calibration into
 modules (see filenames listed in the project tree), but this runs today.
 """
 
-import asyncio, json, os, random, time
+import asyncio, gzip, json, mimetypes, os, random, time, zlib
+from collections import deque
+from bisect import bisect_left
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any, Set
+from typing import Dict, Any, List, Set
 
 from aiohttp import web, WSMsgType
 
+# on-disk patch log format is shared with the other state readers (profiles CLI, state_store)
+from state_store import (STATE_LOG_PATH, append_patch, apply_op, diff_state,
+                         replay_log, write_snapshot)
+
+def _json_default(obj: Any):
+    if isinstance(obj, deque):               # bounded runtime buffers go to disk as plain lists
+        return list(obj)
+    raise TypeError(f"not JSON serializable: {type(obj).__name__}")
+
+try:
+    import orjson  # type: ignore
+
+    def _dumps(obj: Any, pretty: bool = False) -> bytes:
+        opt = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(obj, option=opt, default=_json_default)
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj: Any, pretty: bool = False) -> bytes:
+        if pretty:
+            return json.dumps(obj, indent=2, default=_json_default).encode("utf-8")
+        return json.dumps(obj, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+    _loads = json.loads
+
 ROOT = Path(__file__).resolve().parents[1]
 GUI_DIR = ROOT / "gui"
 DATA_DIR = ROOT / "data"
 STATE_PATH = DATA_DIR / "state.json"
+GZ_DIR = DATA_DIR / "gz"                     # precompressed copies of the GUI text assets
+GZ_SUFFIXES = (".html", ".css", ".js", ".lng")
 
 PORT = int(os.environ.get("EVENCROP_PORT", "8000"))
+SAVE_DEBOUNCE_S = 0.25                       # coalesce state writes within this window
+SAVE_RETRY_S = 5.0                           # pause before retrying a failed state write
+SNAPSHOT_EVERY = 100                         # patches appended before state.json is rewritten
+AUTO_DELAY_IDLE_S = 5.0                      # auto Δ recompute when no press/config event arrives
+BROADCAST_BATCH_SIZE = 50                    # concurrent sends per batch in Hub.send
+TELEMETRY_RANGES = ((6, 10), (1.5, 2.7), (5, 10))   # simulated flow, pressure, speed
+COALESCE_TYPES = ("telemetry", "auto-delay") # broadcasts skipped when identical to the last one
+STATUS_EDGES = (0.05, 0.10, 0.15)            # |deviation| upper bounds for OK / WARN / INSPECT
+STATUS_NAMES = ("OK", "WARN", "INSPECT", "BLOCKED")
 
 # ---------------------------
 # State helpers
@@ -64,7 +103,7 @@ def default_state() -> Dict[str, Any]:
         "autoDelay": { "enabled": True, "manualMs": 500, "geomLeadMs": 0, "currentMs": 500 },
         "units": units,
         "eventLog": [],
-        "pressHistory": [],                  # timestamps of last M-presses (for auto Δ)
+        "pressHistory": [],                  # monotonic ms of last M-presses (for auto Δ; not persisted)
         "simulation": {"telemetry": False, "full": False}
     }
     return st
@@ -73,7 +112,9 @@ def load_state() -> Dict[str, Any]:
     DATA_DIR.mkdir(parents=True, exist_ok=True)
     if STATE_PATH.exists():
         try:
-            st = json.loads(STATE_PATH.read_text())
+            raw = STATE_PATH.read_bytes()
+            st = _loads(raw)
+            had_log = replay_log(st, raw, STATE_LOG_PATH)
             # migration: ensure perDelayMs exists
             for u in st.get("units", []):
                 if "perDelayMs" not in u:
@@ -96,40 +137,90 @@ def load_state() -> Dict[str, Any]:
                 st["autoDelay"].setdefault("currentMs", st["autoDelay"].get("manualMs", 500))
             else:
                 st["autoDelay"] = { "enabled": True, "manualMs": 500, "geomLeadMs": 0, "currentMs": 500 }
+            st = _runtime_views(st)
+            # the writer diffs against this in-memory view, so disk must match it before any
+            # patch is appended: fold the log and persist whatever migration/normalizing changed
+            data = _dumps(snapshot_for_disk(st))
+            if had_log or _loads(data) != _loads(raw):
+                write_snapshot(data, STATE_PATH)
             return st
         except Exception as e:
             print("State load error:", e)
     st = default_state()
     save_state(st)
+    return _runtime_views(st)
+
+# unit fields that survive a restart; the rest (lastDeliveredMl, deviation, status) is per-cycle telemetry
+DURABLE_UNIT_KEYS = frozenset({"id", "enabled", "group", "momentary", "offset", "perDelayMs",
+                               "pulsesPerCycle", "pulsesPerLiter", "msPerMl", "mode"})
+TRANSIENT_KEYS = frozenset({"pressHistory"})
+
+def _now_ms() -> int:
+    """Monotonic milliseconds: immune to wall-clock jumps (NTP sync after boot on the Pi)."""
+    return time.monotonic_ns() // 1_000_000
+
+def snapshot_for_disk(st: Dict[str, Any]) -> Dict[str, Any]:
+    """Durable view of the state for the writer: shallow, shares everything but the unit dicts."""
+    out = {k: v for k, v in st.items() if k not in TRANSIENT_KEYS}
+    out["units"] = [{k: v for k, v in u.items() if k in DURABLE_UNIT_KEYS} for u in st.get("units", [])]
+    return out
+
+def _runtime_views(st: Dict[str, Any]) -> Dict[str, Any]:
+    # telemetry fields aren't on disk: start each unit blank
+    for u in st.get("units", []):
+        u.setdefault("lastDeliveredMl", None)
+        u.setdefault("deviation", None)
+        u.setdefault("status", "OK")
+    # tramline keys come back from JSON as strings (older files may even hold "None"): int ids only
+    tram = {}
+    for k, v in (st.get("tramline") or {}).items():
+        try:
+            if v:
+                tram[int(k)] = True
+        except (TypeError, ValueError):
+            pass
+    st["tramline"] = tram
+    # bounded buffer: appends drop the oldest, no slice rebuild per cycle
+    # monotonic stamps mean nothing across a restart: always start empty
+    st["pressHistory"] = deque(maxlen=20)
+    st["eventLog"] = deque(st.get("eventLog", ()), maxlen=100)   # keep up to 100 recent
     return st
 
 def save_state(st: Dict[str, Any]):
-    try:
-        STATE_PATH.write_text(json.dumps(st, indent=2))
-    except Exception as e:
-        print("State save error:", e)
-
-def log_event(st: Dict[str, Any], msg: str):
-    st["eventLog"].append({"t": int(time.time()*1000), "msg": msg})
-    if len(st["eventLog"]) > 100:            # keep up to 100 recent
-        st["eventLog"] = st["eventLog"][-100:]
-    save_state(st)
+    write_snapshot(_dumps(snapshot_for_disk(st)), STATE_PATH)
 
 # ---------------------------
 # WebSocket hub
 # ---------------------------
 class Hub:
     def __init__(self):
-        self.clients: Set[web.WebSocketResponse] = set()
+        self.clients: List[web.WebSocketResponse] = []
+        self._client_idx: Dict[int, int] = {}        # id(ws) -> index in self.clients
         self.state = load_state()
+        # id -> unit dict (same objects as state["units"]); rebuild if the list is replaced
+        self._unit_by_id: Dict[int, Dict[str, Any]] = {u["id"]: u for u in self.state["units"]}
+        self._active = None                  # cached enabled & non-tramline units (cycle_loop)
+        # tramline OFF unit ids; state["tramline"] is kept as its {id: true} mirror for disk
+        self._tram_off: Set[int] = set(self.state["tramline"])   # keys normalized in _runtime_views
         self._tel_task = None
         self._cyc_task = None
         self._auto_task = None
+        self._persist_task = None
         self._lock = asyncio.Lock()
+        self._rng = random.Random()          # hub-owned generator for the simulators
+        self._dirty = asyncio.Event()        # set => state needs writing (see _persist_loop)
+        # last persisted state (JSON form) + the snapshot the patch log builds on
+        self._last_saved = _loads(_dumps(snapshot_for_disk(self.state)))
+        self._log_base = zlib.crc32(STATE_PATH.read_bytes()) if STATE_PATH.exists() else 0
+        self._patches = 0
+        self._closing = False
+        self._press_evt = asyncio.Event()    # press recorded / auto-delay config changed
+        self._last_payload_hash: Dict[str, int] = {}   # msg type -> hash of last broadcast frame
 
     async def start(self, app: web.Application):
         # background tasks
         self._auto_task = asyncio.create_task(self._auto_delay_loop())
+        self._persist_task = asyncio.create_task(self._persist_loop())
 
     async def stop(self, app: web.Application):
         for t in [self._tel_task, self._cyc_task, self._auto_task]:
@@ -137,28 +228,111 @@ class Hub:
                 t.cancel()
         for ws in list(self.clients):
             await ws.close()
+        # final flush
+        self._closing = True
+        self._dirty.set()
+        if self._persist_task:
+            await self._persist_task
+
+    async def _persist_loop(self):
+        """
+        Coalescing writer: many changes within the window -> one write, done off the loop thread.
+
+        Only the durable view (snapshot_for_disk) is persisted, so telemetry-only
+        changes produce no write at all. Normally only the diff against the last save
+        is appended to state.log.jsonl (tens of bytes for a setter); every SNAPSHOT_EVERY patches, and on shutdown,
+        state.json is rewritten in full and the log is dropped.
+        """
+        while True:
+            await self._dirty.wait()
+            if not self._closing:
+                await asyncio.sleep(SAVE_DEBOUNCE_S)
+            self._dirty.clear()
+            try:
+                saved = await self._flush()
+            except Exception as e:
+                print("State save error:", e)
+                saved = False
+            if not saved:
+                if self._closing:
+                    return                   # shutting down: don't spin on a write that keeps failing
+                self._dirty.set()            # keep the change pending and retry after a pause
+                await asyncio.sleep(SAVE_RETRY_S)
+                continue
+            if self._closing and not self._dirty.is_set():
+                return
+
+    async def _flush(self) -> bool:
+        """One write of whatever changed; False if it didn't make it to disk."""
+        # build bytes on the loop thread (consistent view), only the SD write goes to a worker
+        if self._closing or self._patches >= SNAPSHOT_EVERY:
+            data = _dumps(snapshot_for_disk(self.state))
+            if not await asyncio.to_thread(write_snapshot, data, STATE_PATH):
+                return False
+            self._last_saved = _loads(data)
+            self._log_base = zlib.crc32(data)
+            self._patches = 0
+            return True
+        ops: list = []
+        diff_state(self._last_saved, snapshot_for_disk(self.state), [], ops)
+        if not ops:
+            return True
+        line = _dumps(ops) + b"\n"
+        if not await asyncio.to_thread(append_patch, line, self._log_base, self._patches == 0, STATE_LOG_PATH):
+            self._patches = SNAPSHOT_EVERY   # the log may end in a torn line now: retry as a full snapshot
+            return False
+        for op in _loads(line):
+            apply_op(self._last_saved, op)
+        self._patches += 1
+        return True
 
     async def register(self, ws: web.WebSocketResponse):
-        self.clients.add(ws)
+        self._add_client(ws)
         # emit current auto delay on join
         await self.send({"type":"auto-delay", "value": self.state["autoDelay"]["currentMs"]}, ws=ws)
 
     async def unregister(self, ws: web.WebSocketResponse):
-        self.clients.discard(ws)
+        self._drop_client(ws)
+
+    def _add_client(self, ws: web.WebSocketResponse):
+        if id(ws) not in self._client_idx:
+            self._client_idx[id(ws)] = len(self.clients)
+            self.clients.append(ws)
+
+    def _drop_client(self, ws: web.WebSocketResponse):
+        # O(1): move the last client into the freed slot
+        i = self._client_idx.pop(id(ws), None)
+        if i is None:
+            return
+        last = self.clients.pop()
+        if last is not ws:
+            self.clients[i] = last
+            self._client_idx[id(last)] = i
 
     async def send(self, obj: Dict[str, Any], ws: web.WebSocketResponse=None):
-        msg = json.dumps(obj)
+        # encode once; every client gets the same bytes frame (GUI decodes binary frames)
+        msg = _dumps(obj)
         if ws:
-            await ws.send_str(msg)
+            await ws.send_bytes(msg)
             return
+        t = obj.get("type")
+        if t in COALESCE_TYPES:
+            h = hash(msg)
+            if self._last_payload_hash.get(t) == h:
+                return                       # same frame as last time: nothing new to tell anyone
+            self._last_payload_hash[t] = h
+        # send concurrently so one slow link doesn't hold up the rest; yield between batches
+        # (closed sockets fail their send and are dropped below, or leave via unregister)
+        clients = self.clients[:]
         dead = []
-        for c in self.clients:
-            try:
-                await c.send_str(msg)
-            except Exception:
-                dead.append(c)
+        for i in range(0, len(clients), BROADCAST_BATCH_SIZE):
+            batch = clients[i:i+BROADCAST_BATCH_SIZE]
+            results = await asyncio.gather(*(c.send_bytes(msg) for c in batch), return_exceptions=True)
+            dead.extend(c for c, r in zip(batch, results) if isinstance(r, BaseException))
+            if i + BROADCAST_BATCH_SIZE < len(clients):
+                await asyncio.sleep(0)
         for d in dead:
-            self.clients.discard(d)
+            self._drop_client(d)
 
     # -----------------------
     # Simulators
@@ -166,10 +340,9 @@ class Hub:
     async def telemetry_loop(self):
         try:
             while self.state["simulation"]["telemetry"] or self.state["simulation"]["full"]:
-                # plausibly varying values
-                flow = round(random.uniform(6, 10), 1)
-                pressure = round(random.uniform(1.5, 2.7), 1)
-                speed = round(random.uniform(5, 10), 1)
+                # plausibly varying values: one batch of draws per tick (uniform(lo, hi) == lo + (hi-lo)*random())
+                rnd = self._rng.random
+                flow, pressure, speed = [round(lo + (hi - lo) * rnd(), 1) for lo, hi in TELEMETRY_RANGES]
                 await self.send({"type":"telemetry", "flow":flow, "pressure":pressure, "speed":speed})
                 await asyncio.sleep(0.9)
         except asyncio.CancelledError:
@@ -179,68 +352,78 @@ class Hub:
         try:
             # simulate “switch presses” cadence ~ every 1.0–1.5s
             while self.state["simulation"]["full"]:
-                now = time.time()
-                # record synthetic press
-                self.state["pressHistory"].append(now)
-                self.state["pressHistory"] = self.state["pressHistory"][-20:]
-                # deliver to enabled & not-tramline units
-                target = max(5, int(self.state.get("targetMl", 100)))
-                for u in self.state["units"]:
-                    if not u["enabled"]: continue
-                    if self.state["tramline"].get(str(u["id"])) or self.state["tramline"].get(u["id"]):
-                        continue
-                    # simulate delivered ml
-                    dev = random.uniform(-0.05, 0.05)  # ±5%
-                    delivered = max(0, round(target * (1.0 + dev)))
-                    u["lastDeliveredMl"] = delivered
-                    u["deviation"] = (delivered - target) / max(1, target)
-                    # status
-                    absd = abs(u["deviation"] or 0.0)
-                    if absd <= 0.05:
-                        u["status"] = "OK"
-                    elif absd <= 0.10:
-                        u["status"] = "WARN"
-                    elif absd <= 0.15:
-                        u["status"] = "INSPECT"
-                    else:
-                        u["status"] = "BLOCKED"
-                save_state(self.state)
+                async with self._lock:
+                    now = _now_ms()
+                    # record synthetic press
+                    self.state["pressHistory"].append(now)   # deque(maxlen=20)
+                    self._press_evt.set()
+                    # deliver to enabled & not-tramline units
+                    target = max(5, int(self.state.get("targetMl", 100)))
+                    active = self._active_units()
+                    # simulate delivered ml for the whole batch (±5%)
+                    rnd = self._rng.random
+                    devs = [0.1 * rnd() - 0.05 for _ in active]
+                    denom = max(1, target)
+                    for u, dev in zip(active, devs):
+                        delivered = max(0, round(target * (1.0 + dev)))
+                        deviation = (delivered - target) / denom
+                        u["lastDeliveredMl"] = delivered
+                        u["deviation"] = deviation
+                        # status: one bisect over the edges instead of an if-ladder
+                        u["status"] = STATUS_NAMES[bisect_left(STATUS_EDGES, abs(deviation))]
+                    self._dirty.set()
                 await self.send({"type":"cycle"})
-                await asyncio.sleep(random.uniform(1.0, 1.5))
+                await asyncio.sleep(self._rng.uniform(1.0, 1.5))
         except asyncio.CancelledError:
             pass
 
+    def _active_units(self):
+        """Units that fire this cycle; rebuilt only after enable/tramline changes."""
+        if self._active is None:
+            tram = self._tram_off
+            self._active = [u for u in self.state["units"] if u["enabled"] and u["id"] not in tram]
+        return self._active
+
     async def _auto_delay_loop(self):
         try:
             while True:
-                await asyncio.sleep(0.5)
-                ad = self.state["autoDelay"]
-                if not ad.get("enabled", True):
-                    # stick to manual, but still publish current=manual+geom
-                    cur = int(ad.get("manualMs", 500)) + int(ad.get("geomLeadMs", 0))
-                    cur = max(0, cur)
-                    if cur != ad.get("currentMs"):
-                        ad["currentMs"] = cur
-                        save_state(self.state)
-                        await self.send({"type":"auto-delay","value":cur})
-                    continue
-                # derive from recent press cadence
-                ph = [p for p in self.state["pressHistory"] if time.time()-p < 15]
-                if len(ph) >= 3:
-                    intervals = [ (ph[i]-ph[i-1]) for i in range(1,len(ph)) ]
-                    avg = sum(intervals)/len(intervals)
-                    b = max(0, int(avg*1000/2))  # half the average interval, ms
-                else:
-                    b = int(ad.get("manualMs", 500))
-                b += int(ad.get("geomLeadMs", 0))
-                b = max(0, b)
-                if b != ad.get("currentMs"):
-                    ad["currentMs"] = b
-                    save_state(self.state)
-                    await self.send({"type":"auto-delay","value":b})
+                # wake on a press (or config change); otherwise recompute on the idle timeout
+                try:
+                    await asyncio.wait_for(self._press_evt.wait(), AUTO_DELAY_IDLE_S)
+                except asyncio.TimeoutError:
+                    pass
+                self._press_evt.clear()
+                async with self._lock:
+                    cur = self._recompute_auto_delay()
+                if cur is not None:
+                    await self.send({"type":"auto-delay","value":cur})
         except asyncio.CancelledError:
             pass
 
+    def _recompute_auto_delay(self):
+        """Update autoDelay.currentMs; returns the new value if it changed (caller holds _lock)."""
+        ad = self.state["autoDelay"]
+        if not ad.get("enabled", True):
+            # stick to manual, but still publish current=manual+geom
+            b = int(ad.get("manualMs", 500)) + int(ad.get("geomLeadMs", 0))
+        else:
+            # derive from recent press cadence
+            now = _now_ms()
+            ph = [p for p in self.state["pressHistory"] if now - p < 15000]
+            if len(ph) >= 3:
+                # mean of consecutive intervals == (last - first) / (n - 1)
+                avg = (ph[-1] - ph[0]) / (len(ph) - 1)
+                b = max(0, int(avg/2))       # half the average interval, ms
+            else:
+                b = int(ad.get("manualMs", 500))
+            b += int(ad.get("geomLeadMs", 0))
+        b = max(0, b)
+        if b == ad.get("currentMs"):
+            return None
+        ad["currentMs"] = b
+        self._dirty.set()
+        return b
+
     def _restart_tel_task(self):
         if self._tel_task and not self._tel_task.done():
             self._tel_task.cancel()
@@ -256,111 +439,42 @@ class Hub:
     # -----------------------
     # Message handling
     # -----------------------
+    def log_event(self, msg: str):
+        # deque(maxlen=100) drops the oldest; the writer persists it with everything else
+        self.state["eventLog"].append({"t": int(time.time()*1000), "msg": msg})
+        self._dirty.set()
+
     async def handle_msg(self, m: Dict[str, Any]):
+        # mutate under the lock (sockets are handled concurrently), broadcast after releasing it
+        async with self._lock:
+            out = await self._apply_msg(m)
+        if out:
+            await self.send(out)
+
+    async def _apply_msg(self, m: Dict[str, Any]):
+        """Apply one GUI message to the state; returns a message to broadcast, if any. No I/O here."""
         t = m.get("type")
         if t == "set":
-            key = m.get("key")
-            # simple setters
-            if key == "target":
-                self.state["targetMl"] = int(m.get("value", 100))
-                save_state(self.state)
-                log_event(self.state, f"Target set to {self.state['targetMl']} ml/plant")
-            elif key == "running":
-                self.state["running"] = bool(m.get("value"))
-                save_state(self.state)
-                log_event(self.state, "RUN" if self.state["running"] else "STOP")
-            elif key == "unit-enabled":
-                uid = int(m.get("id"))
-                for u in self.state["units"]:
-                    if u["id"] == uid:
-                        u["enabled"] = bool(m.get("value"))
-                save_state(self.state)
-            elif key == "unit-momentary":
-                uid = int(m.get("id")); val = m.get("value","M1")
-                for u in self.state["units"]:
-                    if u["id"] == uid:
-                        u["momentary"] = val
-                save_state(self.state)
-            elif key == "unit-group":
-                uid = int(m.get("id")); val = m.get("value","A")
-                for u in self.state["units"]:
-                    if u["id"] == uid:
-                        u["group"] = "A" if val=="A" else "B"
-                save_state(self.state)
-            elif key == "unit-offset":
-                uid = int(m.get("id")); val = int(m.get("value",0))
-                for u in self.state["units"]:
-                    if u["id"] == uid:
-                        u["offset"] = max(0, min(100, val))
-                save_state(self.state)
-            elif key == "unit-delay-ms":
-                uid = int(m.get("id")); val = int(m.get("value",0))
-                for u in self.state["units"]:
-                    if u["id"] == uid:
-                        u["perDelayMs"] = val
-                save_state(self.state)
-            elif key == "delivery-mode":
-                self.state["deliveryMode"] = "timed" if m.get("value")=="timed" else "flow"
-                save_state(self.state)
-            elif key == "unit-delivery-mode":
-                uid = int(m.get("id")); val = m.get("value","inherit")
-                for u in self.state["units"]:
-                    if u["id"] == uid:
-                        u["mode"] = val if val in ("inherit","flow","timed") else "inherit"
-                save_state(self.state)
-            elif key == "unit-ppc":
-                uid = int(m.get("id")); val = max(1, int(m.get("value",100)))
-                for u in self.state["units"]:
-                    if u["id"] == uid:
-                        u["pulsesPerCycle"] = val
-                save_state(self.state)
-            
-            elif key == "unit-kfactor":
-                uid = int(m.get("id")); val = max(1, int(m.get("value",450)))
-                for u in self.state["units"]:
-                    if u["id"] == uid:
-                        u["pulsesPerLiter"] = val
-                save_state(self.state)
-elif key == "unit-msperml":
-                uid = int(m.get("id")); val = max(1, float(m.get("value",5.0)))
-                for u in self.state["units"]:
-                    if u["id"] == uid:
-                        u["msPerMl"] = val
-                save_state(self.state)
-            elif key == "auto-delay":
-                cfg = m.get("value",{})
-                ad = self.state["autoDelay"]
-                ad["enabled"]   = bool(cfg.get("enabled", ad.get("enabled", True)))
-                if "manualMs" in cfg:   ad["manualMs"] = int(cfg["manualMs"])
-                if "geomLeadMs" in cfg: ad["geomLeadMs"] = int(cfg["geomLeadMs"])
-                # currentMs will be recomputed by loop; broadcast now with best guess
-                cur = (ad.get("manualMs",500) if not ad.get("enabled",True) else ad.get("currentMs",500))
-                await self.send({"type":"auto-delay","value": int(cur)})
-                save_state(self.state)
-            elif key == "gpio":
-                # store minimal gpio mapping; real hardware layer would apply this
-                name = m.get("name"); pin = m.get("pin")
-                self.state.setdefault("gpio", {})[name] = pin
-                save_state(self.state)
-            elif key == "buzzer-muted":
-                self.state["buzzer"]["muted"] = bool(m.get("value"))
-                save_state(self.state)
-            elif key == "buzzer-hardmute":
-                self.state["buzzer"]["hardMute"] = bool(m.get("value"))
-                save_state(self.state)
-
+            fn = SETTERS.get(m.get("key"))
+            if fn:
+                out = await fn(self, m)
+                self._dirty.set()
+                return out
         elif t == "tram":
-            uid = str(m.get("id"))
-            off = bool(m.get("off"))
-            self.state["tramline"][uid] = off
-            # clean false entries
-            for k in list(self.state["tramline"].keys()):
-                if not self.state["tramline"][k]:
-                    self.state["tramline"].pop(k, None)
-            save_state(self.state)
+            uid = int(m.get("id"))
+            if m.get("off"):
+                self._tram_off.add(uid)
+                self.state["tramline"][uid] = True
+            else:
+                self._tram_off.discard(uid)
+                self.state["tramline"].pop(uid, None)
+            self._active = None
+            self._dirty.set()
         elif t == "tram-clear":
+            self._tram_off.clear()
             self.state["tramline"] = {}
-            save_state(self.state)
+            self._active = None
+            self._dirty.set()
         elif t == "simulate":
             mode = m.get("mode","telemetry")
             on = bool(m.get("on"))
@@ -374,7 +488,7 @@ elif key == "unit-msperml":
             else:
                 self.state["simulation"]["telemetry"] = on
                 self._restart_tel_task()
-            save_state(self.state)
+            self._dirty.set()
         elif t == "cal":
             # simple acknowledgment / logging so GUI flows; real impl would drive IO
             mode = m.get("mode")
@@ -382,13 +496,85 @@ elif key == "unit-msperml":
             uid  = m.get("id")
             if mode == "timed" and cmd == "start":
                 ms = int(m.get("ms", 5000))
-                log_event(self.state, f"Timed calibration start: unit {uid}, {ms} ms")
+                self.log_event(f"Timed calibration start: unit {uid}, {ms} ms")
             elif mode == "timed" and cmd == "stop":
-                log_event(self.state, f"Timed calibration stop: unit {uid}")
+                self.log_event(f"Timed calibration stop: unit {uid}")
             elif mode == "flow" and cmd == "start":
                 tgt = int(m.get("targetMl", 1000))
-                log_event(self.state, f"Flow calibration run: unit {uid}, target {tgt} ml")
-            save_state(self.state)
+                self.log_event(f"Flow calibration run: unit {uid}, target {tgt} ml")
+            self._dirty.set()
+
+# ---------------------------
+# "set" handlers: key -> async fn(hub, msg), run under hub._lock; handle_msg marks the
+# state dirty afterwards and broadcasts whatever the handler returns
+# ---------------------------
+async def _set_target(hub: Hub, m: Dict[str, Any]):
+    hub.state["targetMl"] = int(m.get("value", 100))
+    hub.log_event(f"Target set to {hub.state['targetMl']} ml/plant")
+
+async def _set_running(hub: Hub, m: Dict[str, Any]):
+    hub.state["running"] = bool(m.get("value"))
+    hub.log_event("RUN" if hub.state["running"] else "STOP")
+
+async def _set_delivery_mode(hub: Hub, m: Dict[str, Any]):
+    hub.state["deliveryMode"] = "timed" if m.get("value")=="timed" else "flow"
+
+async def _set_auto_delay(hub: Hub, m: Dict[str, Any]):
+    cfg = m.get("value",{})
+    ad = hub.state["autoDelay"]
+    ad["enabled"]   = bool(cfg.get("enabled", ad.get("enabled", True)))
+    if "manualMs" in cfg:   ad["manualMs"] = int(cfg["manualMs"])
+    if "geomLeadMs" in cfg: ad["geomLeadMs"] = int(cfg["geomLeadMs"])
+    # currentMs will be recomputed by loop; broadcast now with best guess
+    cur = (ad.get("manualMs",500) if not ad.get("enabled",True) else ad.get("currentMs",500))
+    hub._press_evt.set()
+    return {"type":"auto-delay","value": int(cur)}
+
+async def _set_gpio(hub: Hub, m: Dict[str, Any]):
+    # store minimal gpio mapping; real hardware layer would apply this
+    name = m.get("name"); pin = m.get("pin")
+    hub.state.setdefault("gpio", {})[name] = pin
+
+async def _set_buzzer_muted(hub: Hub, m: Dict[str, Any]):
+    hub.state["buzzer"]["muted"] = bool(m.get("value"))
+
+async def _set_buzzer_hardmute(hub: Hub, m: Dict[str, Any]):
+    hub.state["buzzer"]["hardMute"] = bool(m.get("value"))
+
+def _unit_setter(field: str, parse):
+    # per-unit field: coerce the value first (bad input raises like before), then apply if the id exists
+    async def _set(hub: Hub, m: Dict[str, Any]):
+        uid = int(m.get("id")); val = parse(m)
+        u = hub._unit_by_id.get(uid)
+        if u:
+            u[field] = val
+    return _set
+
+async def _set_unit_enabled(hub: Hub, m: Dict[str, Any]):
+    uid = int(m.get("id"))
+    u = hub._unit_by_id.get(uid)
+    if u:
+        u["enabled"] = bool(m.get("value"))
+    hub._active = None
+
+SETTERS = {
+    "target":             _set_target,
+    "running":            _set_running,
+    "unit-enabled":       _set_unit_enabled,
+    "unit-momentary":     _unit_setter("momentary",      lambda m: m.get("value","M1")),
+    "unit-group":         _unit_setter("group",          lambda m: "A" if m.get("value","A")=="A" else "B"),
+    "unit-offset":        _unit_setter("offset",         lambda m: max(0, min(100, int(m.get("value",0))))),
+    "unit-delay-ms":      _unit_setter("perDelayMs",     lambda m: int(m.get("value",0))),
+    "delivery-mode":      _set_delivery_mode,
+    "unit-delivery-mode": _unit_setter("mode",           lambda m: m.get("value","inherit") if m.get("value","inherit") in ("inherit","flow","timed") else "inherit"),
+    "unit-ppc":           _unit_setter("pulsesPerCycle", lambda m: max(1, int(m.get("value",100)))),
+    "unit-kfactor":       _unit_setter("pulsesPerLiter", lambda m: max(1, int(m.get("value",450)))),
+    "unit-msperml":       _unit_setter("msPerMl",        lambda m: max(1, float(m.get("value",5.0)))),
+    "auto-delay":         _set_auto_delay,
+    "gpio":               _set_gpio,
+    "buzzer-muted":       _set_buzzer_muted,
+    "buzzer-hardmute":    _set_buzzer_hardmute,
+}
 
 # ---------------------------
 # HTTP / Web handlers
@@ -403,7 +589,7 @@ async def ws_handler(request: web.Request):
         async for msg in ws:
             if msg.type == WSMsgType.TEXT:
                 try:
-                    data = json.loads(msg.data)
+                    data = _loads(msg.data)
                     await hub.handle_msg(data)
                 except Exception as e:
                     print("WS parse/handle error:", e)
@@ -416,14 +602,103 @@ async def ws_handler(request: web.Request):
 async def index_handler(request: web.Request):
     return web.FileResponse(GUI_DIR / "index.html")
 
+# precompressed GUI: gzip each text asset once at startup, hand the .gz to gzip-capable browsers
+def _gz_matches(src_st: os.stat_result, dst: Path) -> bool:
+    # same mtime (copied over from the source) and same size (gzip trailer: input length mod 2**32)
+    try:
+        if dst.stat().st_mtime_ns != src_st.st_mtime_ns:
+            return False
+        with open(dst, "rb") as f:
+            f.seek(-4, os.SEEK_END)
+            return int.from_bytes(f.read(4), "little") == src_st.st_size & 0xFFFFFFFF
+    except OSError:
+        return False
+
+def _precompress_gui():
+    wanted = set()
+    for src in GUI_DIR.rglob("*"):
+        if src.suffix not in GZ_SUFFIXES or not src.is_file():
+            continue
+        dst = GZ_DIR / (src.relative_to(GUI_DIR).as_posix() + ".gz")
+        wanted.add(dst)
+        try:
+            st = src.stat()
+            # equality, not "newer": an unzipped update can carry older mtimes than our copy
+            if _gz_matches(st, dst):
+                continue
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            tmp = dst.with_suffix(".tmp")
+            tmp.write_bytes(gzip.compress(src.read_bytes(), 9, mtime=0))
+            os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+            os.replace(tmp, dst)
+        except OSError as e:
+            print("GUI precompress error:", e)
+    # sources that went away must not keep being served
+    for gz in GZ_DIR.rglob("*.gz") if GZ_DIR.exists() else ():
+        if gz not in wanted:
+            try:
+                gz.unlink()
+            except OSError as e:
+                print("GUI precompress error:", e)
+    _gz_asset.cache_clear()
+
+async def _precompress_on_startup(app: web.Application):
+    await asyncio.to_thread(_precompress_gui)
+
+@lru_cache(maxsize=128)
+def _gz_asset(rel: str):
+    """URL path -> (gz file, content type), or None; the stat happens once per path."""
+    if not rel.endswith(GZ_SUFFIXES):
+        return None
+    # resolve, then insist on staying under GZ_DIR (covers ..\ and drive paths on Windows too)
+    root = GZ_DIR.resolve()
+    gz = (root / (rel + ".gz")).resolve()
+    if not gz.is_relative_to(root) or not gz.is_file():
+        return None
+    return gz, mimetypes.guess_type(rel)[0] or "application/octet-stream"
+
+@lru_cache(maxsize=32)
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """Accept-Encoding allows gzip: listed (or covered by *) with a q above 0."""
+    star = None
+    for token in accept_encoding.split(","):
+        coding, _, params = token.partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding in ("gzip", "x-gzip"):
+            return q > 0
+        if coding == "*":
+            star = q > 0
+    return bool(star)
+
+@web.middleware
+async def gzip_static_middleware(request: web.Request, handler):
+    if request.method in ("GET", "HEAD") and _accepts_gzip(request.headers.get("Accept-Encoding", "")):
+        rel = request.path.lstrip("/") or "index.html"
+        hit = _gz_asset(rel)
+        if hit:
+            gz, ctype = hit
+            return web.FileResponse(gz, headers={"Content-Type": ctype,
+                                                 "Content-Encoding": "gzip",
+                                                 "Vary": "Accept-Encoding"})
+    return await handler(request)
+
 def make_app() -> web.Application:
-    app = web.Application()
+    app = web.Application(middlewares=[gzip_static_middleware])
     # routes
     app.router.add_get("/ws", ws_handler)
     app.router.add_get("/", index_handler)
     # serve entire GUI at root
     app.router.add_static("/", str(GUI_DIR), show_index=False)
     # lifecycle
+    app.on_startup.append(_precompress_on_startup)
     app.on_startup.append(hub.start)
     app.on_shutdown.append(hub.stop)
     return app
@@ -432,7 +707,15 @@ def main():
     app = make_app()
     print(f"Even Crop Brain — serving GUI from {GUI_DIR}")
     print(f"Open: http://localhost:{PORT}/  (WebSocket at /ws)")
-    web.run_app(app, host="0.0.0.0", port=PORT)
+    # libuv-backed loop when available (not on Windows); stock asyncio otherwise
+    loop = None
+    if os.name != "nt":
+        try:
+            import uvloop  # type: ignore
+            loop = uvloop.new_event_loop()
+        except ImportError:
+            pass
+    web.run_app(app, host="0.0.0.0", port=PORT, loop=loop)
 
 if __name__ == "__main__":
     main()
@@ -5,7 +5,8 @@ This module centralizes reading/writing the Brain state JSON and applies
 lightweight migrations so older files keep working as we add fields.
 
 NOTE: The current `brain/server.py` carries its own minimal state helpers
-so it can run standalone. This module is drop-in compatible; you can
+so it can run standalone, but shares the on-disk patch log format
+(state.log.jsonl) from here. This module is drop-in compatible; you can
 switch server.py to `from .state_store import *` if you prefer a single
 source of truth.
 """
@@ -15,19 +16,38 @@ import json
 import os
 import shutil
 import time
+import zlib
+from collections import deque
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
+
+try:
+    import orjson  # type: ignore
+
+    def _dumps(obj: Any, pretty: bool = False) -> bytes:
+        opt = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(obj, option=opt)
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj: Any, pretty: bool = False) -> bytes:
+        if pretty:
+            return json.dumps(obj, indent=2).encode("utf-8")
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+    _loads = json.loads
 
 ROOT = Path(__file__).resolve().parents[1]
 DATA_DIR = ROOT / "data"
 STATE_PATH = DATA_DIR / "state.json"
 BACKUP_PATH = DATA_DIR / "state.backup.json"
+STATE_LOG_PATH = DATA_DIR / "state.log.jsonl"   # patches on top of state.json (server Hub writer)
 
 # ---------------------------
 # Defaults & migrations
 # ---------------------------
 
-def _default_units() -> List[Dict[str, Any]]:
+def _build_default_units() -> List[Dict[str, Any]]:
     out = []
     for i in range(11):
         out.append({
@@ -46,6 +66,12 @@ def _default_units() -> List[Dict[str, Any]]:
         })
     return out
 
+_UNITS_TEMPLATE = _build_default_units()
+
+def _default_units() -> List[Dict[str, Any]]:
+    # unit dicts are flat, so a shallow copy of each is a full copy
+    return [dict(u) for u in _UNITS_TEMPLATE]
+
 def default_state() -> Dict[str, Any]:
     return {
         "targetMl": 100,
@@ -77,7 +103,8 @@ def _migrate(st: Dict[str, Any]) -> Dict[str, Any]:
     st.setdefault("tramPresets", {"left":[], "right":[], "active": None})
     st.setdefault("buzzer", {"muted": False, "hardMute": False})
     st.setdefault("autoDelay", { "enabled": True, "manualMs": 500, "geomLeadMs": 0, "currentMs": 500 })
-    st.setdefault("units", _default_units())
+    if "units" not in st:                # don't build 11 dicts just to throw them away
+        st["units"] = _default_units()
     st.setdefault("eventLog", [])
     st.setdefault("pressHistory", [])
     st.setdefault("simulation", {"telemetry": False, "full": False})
@@ -104,15 +131,158 @@ def _migrate(st: Dict[str, Any]) -> Dict[str, Any]:
 
     return st
 
+# ---------------------------
+# Patch log (state.log.jsonl)
+# ---------------------------
+# The server's writer appends small diffs instead of rewriting state.json:
+#   line 1: {"base": crc32 of the state.json bytes the patches apply to}
+#   then one JSON list of ops per line: [path, value] = set, [path] = delete,
+#   [path, "+", items, maxlen] = append to a bounded list (eventLog), keep the last maxlen
+# A log whose base doesn't match state.json is stale and ignored. The real
+# state is state.json + log, so read it through read_state()/load_state().
+
+def log_path_for(path: Path) -> Path:
+    return path.with_name(path.stem + ".log.jsonl")
+
+def write_snapshot(data: bytes, path: Path = STATE_PATH) -> bool:
+    """Full snapshot: write aside, rename over state.json, drop the patch log."""
+    try:
+        tmp = path.with_suffix(".json.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())             # on the SD card before the rename makes it live
+        os.replace(tmp, path)
+        log_path_for(path).unlink(missing_ok=True)
+        return True
+    except Exception as e:
+        print("State save error:", e)
+        return False
+
+def append_patch(line: bytes, base_crc: int, new_log: bool, log_path: Path = STATE_LOG_PATH) -> bool:
+    """Append one patch line; a new log starts with a header naming the snapshot it applies to."""
+    try:
+        with open(log_path, "wb" if new_log else "ab") as f:
+            if new_log:
+                f.write(_dumps({"base": base_crc}) + b"\n")
+            f.write(line)
+        return True
+    except Exception as e:
+        print("State save error:", e)
+        return False
+
+def _appended(a: list, b: deque) -> Optional[list]:
+    """Items that, appended to a and trimmed to b.maxlen, give b; None if b doesn't continue a."""
+    bl = list(b)
+    n = len(bl)
+    for k in range(1, n + 1):               # fewest new items first: usually just one
+        keep = n - k
+        grown = len(a) + k
+        if keep > len(a) or (min(b.maxlen, grown) if b.maxlen else grown) != n:
+            continue
+        if bl[:keep] == a[len(a) - keep:]:
+            return bl[keep:]
+    return None
+
+def diff_state(a: Any, b: Any, path: list, out: list):
+    """
+    Collect ops turning a (last saved, JSON form) into b (live state):
+      [path, value] = set, [path] = delete, [path, "+", items, maxlen] = append.
+    Dict keys compare as JSON strings.
+    """
+    if isinstance(b, deque):
+        if isinstance(a, list):
+            if len(a) == len(b) and a == list(b):
+                return
+            items = _appended(a, b)
+            if items is not None:
+                # bounded log grew by a few entries: ship those, not the whole list
+                out.append([path, "+", items, b.maxlen])
+                return
+        b = list(b)
+    if isinstance(a, dict) and isinstance(b, dict):
+        seen = set()
+        for k, v in b.items():
+            k = str(k)
+            seen.add(k)
+            if k in a:
+                diff_state(a[k], v, path + [k], out)
+            else:
+                out.append([path + [k], v])
+        for k in a:
+            if k not in seen:
+                out.append([path + [k]])
+    elif isinstance(a, list) and isinstance(b, list) and len(a) == len(b):
+        sub: list = []
+        for i, (x, y) in enumerate(zip(a, b)):
+            diff_state(x, y, path + [i], sub)
+        # shifted lists (eventLog, pressHistory) would touch every slot: send those whole
+        out.extend(sub if len(sub) <= len(b) // 2 else [[path, b]])
+    elif type(a) is not type(b) or a != b:
+        out.append([path, b])
+
+def apply_op(st: Dict[str, Any], op: list):
+    *parents, last = op[0]
+    cur = st
+    for k in parents:
+        if isinstance(cur, dict) and k not in cur:
+            if len(op) == 1:
+                return                       # delete under a missing parent: already gone
+            cur[k] = {}                      # set under a missing parent: create it
+        cur = cur[k]
+    if len(op) == 1:
+        cur.pop(last, None)
+    elif len(op) == 2:
+        cur[last] = op[1]
+    else:
+        lst = cur.setdefault(last, []) if isinstance(cur, dict) else cur[last]
+        lst.extend(op[2])
+        if op[3]:
+            del lst[:-op[3]]
+
+def replay_log(st: Dict[str, Any], base: bytes, log_path: Path = STATE_LOG_PATH) -> bool:
+    """Apply the patch log onto st if it was written against this snapshot. True if a log existed."""
+    try:
+        lines = log_path.read_bytes().splitlines()
+    except FileNotFoundError:
+        return False
+    try:
+        if not lines or _loads(lines[0]).get("base") != zlib.crc32(base):
+            return True                      # stale (snapshot already newer): drop it
+    except ValueError:
+        return True
+    for ln in lines[1:]:
+        try:
+            ops = _loads(ln)
+        except ValueError as e:
+            # torn last line after a crash: keep what applied cleanly
+            print("State log replay stopped:", e)
+            break
+        for op in ops:
+            try:
+                apply_op(st, op)
+            except (LookupError, TypeError) as e:
+                # an op that doesn't fit (e.g. list index gone) is skipped, not the rest of the log
+                print("State log op skipped:", op[0], e)
+    return True
+
+def read_state(path: Path = STATE_PATH) -> Dict[str, Any]:
+    """Persisted state as the server sees it (snapshot + pending patches). Never writes."""
+    raw = path.read_bytes()
+    st = _loads(raw)
+    replay_log(st, raw, log_path_for(path))
+    return st
+
 # ---------------------------
 # IO helpers
 # ---------------------------
 
-def save_state_atomic(st: Dict[str, Any], path: Path = STATE_PATH):
+def save_state_atomic(st: Dict[str, Any], path: Path = STATE_PATH, pretty: bool = False):
     DATA_DIR.mkdir(parents=True, exist_ok=True)
     tmp = path.with_suffix(".json.tmp")
-    data = json.dumps(st, indent=2)
-    tmp.write_text(data)
+    # serialize straight to bytes and hand them to the file (compact unless asked; see dump_pretty())
+    with open(tmp, "wb") as f:
+        f.write(_dumps(st, pretty))
     # Best effort backup
     try:
         if path.exists():
@@ -120,20 +290,26 @@ def save_state_atomic(st: Dict[str, Any], path: Path = STATE_PATH):
     except Exception:
         pass
     tmp.replace(path)
+    # the snapshot now holds everything: patches written against the old one must go
+    log_path_for(path).unlink(missing_ok=True)
 
 def load_state(path: Path = STATE_PATH) -> Dict[str, Any]:
     DATA_DIR.mkdir(parents=True, exist_ok=True)
     if path.exists():
         try:
-            st = json.loads(path.read_text())
+            raw = path.read_bytes()
+            st = _loads(raw)
+            had_log = replay_log(st, raw, log_path_for(path))
+            orig = _loads(raw) if not had_log else None
             st = _migrate(st)
-            save_state_atomic(st, path)  # write back normalized
+            if had_log or st != orig:
+                save_state_atomic(st, path)  # write back normalized (folds + drops the patch log)
             return st
         except Exception as e:
             # Try backup before giving up
             try:
                 if BACKUP_PATH.exists():
-                    st = json.loads(BACKUP_PATH.read_text())
+                    st = _loads(BACKUP_PATH.read_bytes())
                     st = _migrate(st)
                     save_state_atomic(st, path)
                     return st
@@ -152,6 +328,12 @@ def log_event(st: Dict[str, Any], msg: str, max_keep: int = 100):
     save_state_atomic(st)
 
 # Convenience helpers (optional use)
+def dump_pretty(st: Dict[str, Any] = None, path: Path = STATE_PATH) -> str:
+    """Indented JSON of st (or of the state on disk, read-only) for humans/debugging."""
+    if st is None:
+        st = read_state(path)
+    return _dumps(st, pretty=True).decode("utf-8")
+
 def get_state() -> Dict[str, Any]:
     return load_state()
 
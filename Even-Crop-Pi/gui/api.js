@@ -14,6 +14,8 @@ function emitTel(d){ for(const f of listeners.tel){ try{ f(d); }catch(_){} } }
 function emitCycle(){ for(const f of listeners.cyc){ try{ f(); }catch(_){} } }
 function emitEvt(e){ for(const f of listeners.evt){ try{ f(e); }catch(_){} } }
 
+const utf8 = new TextDecoder();   // Brain sends JSON as binary (utf-8) frames
+
 const isMock = () => /\bmode=mock\b/i.test(location.search);
 
 // ---------- init ----------
@@ -34,6 +36,7 @@ export async function initAPI(){
 
 async function tryWS(url){
   ws = new WebSocket(url);
+  ws.binaryType = 'arraybuffer';
   await new Promise((res, rej)=>{
     const to = setTimeout(()=> rej(new Error('WS timeout')), 4000);
     ws.onopen = ()=>{ clearTimeout(to); wsOpen = true; res(); };
@@ -42,7 +45,7 @@ async function tryWS(url){
 
   ws.onmessage = (ev)=>{
     try{
-      const m = JSON.parse(ev.data);
+      const m = JSON.parse(typeof ev.data === 'string' ? ev.data : utf8.decode(ev.data));
       if(m.type === 'telemetry') emitTel(m);
       else if(m.type === 'cycle') emitCycle();
       else if(m.type === 'event') emitEvt(m);
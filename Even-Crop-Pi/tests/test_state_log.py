@@ -0,0 +1,155 @@
+"""
+Round trip for the state patch log (state.json + state.log.jsonl):
+diff -> append -> replay -> compact, plus the torn-line and stale-log cases.
+
+Runs under pytest, or standalone: python tests/test_state_log.py
+"""
+import copy
+import sys
+import tempfile
+import zlib
+from collections import deque
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "brain"))
+import state_store as ss  # noqa: E402
+
+
+def _json_form(st):
+    # what a reader gets back from disk (deques as lists, int keys as strings)
+    return ss._loads(ss._dumps({k: list(v) if isinstance(v, deque) else v for k, v in st.items()}))
+
+
+def _write_patches(path, live):
+    """Snapshot the defaults, then log a few rounds of edits the way the Hub writer does."""
+    data = ss._dumps(live)
+    assert ss.write_snapshot(data, path)
+    saved = ss._loads(data)
+    log = ss.log_path_for(path)
+    rounds = [
+        lambda st: st.update(targetMl=77),
+        lambda st: st["units"][2].update(msPerMl=3.5, enabled=True),
+        lambda st: st["tramline"].update({4: True, 7: True}),
+        lambda st: st["tramline"].pop(4),
+        lambda st: st.update(eventLog=deque([{"t": 1, "msg": "RUN"}], maxlen=100)),
+        lambda st: st["units"].pop(),
+    ]
+    for n, edit in enumerate(rounds):
+        edit(live)
+        ops = []
+        ss.diff_state(saved, live, [], ops)
+        assert ops
+        line = ss._dumps(ops) + b"\n"
+        assert ss.append_patch(line, zlib.crc32(data), n == 0, log)
+        for op in ss._loads(line):
+            ss.apply_op(saved, op)
+    return data, log
+
+
+def test_round_trip_replay_and_compact():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "state.json"
+        live = ss.default_state()
+        data, log = _write_patches(path, live)
+
+        # readers see snapshot + patches, without touching either file
+        assert ss.read_state(path) == _json_form(live)
+        assert path.read_bytes() == data and log.exists()
+
+        # a torn last line (crash mid-append) keeps what applied cleanly
+        with open(log, "ab") as f:
+            f.write(b'[[["targetMl"],')
+        assert ss.read_state(path) == _json_form(live)
+
+        # load_state folds the log into a fresh snapshot and drops it
+        old_data_dir, old_backup = ss.DATA_DIR, ss.BACKUP_PATH
+        ss.DATA_DIR, ss.BACKUP_PATH = Path(tmp), Path(tmp) / "state.backup.json"
+        try:
+            st = ss.load_state(path)
+        finally:
+            ss.DATA_DIR, ss.BACKUP_PATH = old_data_dir, old_backup
+        assert not log.exists()
+        assert st == _json_form(live)
+        assert ss.read_state(path) == _json_form(live)
+
+
+def test_stale_log_is_ignored():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "state.json"
+        st = ss.default_state()
+        assert ss.write_snapshot(ss._dumps(st), path)
+        ss.log_path_for(path).write_bytes(b'{"base":1}\n[[["targetMl"],5]]\n')
+        assert ss.read_state(path)["targetMl"] == st["targetMl"]
+
+
+def test_patch_under_missing_key_does_not_stop_replay():
+    # an older snapshot without "buzzer": a later set on buzzer.muted must not eat the patches after it
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "state.json"
+        st = ss.default_state()
+        del st["buzzer"]
+        data = ss._dumps(st)
+        assert ss.write_snapshot(data, path)
+        log = ss.log_path_for(path)
+        assert ss.append_patch(b'[[["buzzer","muted"],true]]\n', zlib.crc32(data), True, log)
+        assert ss.append_patch(b'[[["gone","x"]],[["units",99,"enabled"],true]]\n', zlib.crc32(data), False, log)
+        assert ss.append_patch(b'[[["targetMl"],77]]\n', zlib.crc32(data), False, log)
+        out = ss.read_state(path)
+        assert out["buzzer"] == {"muted": True}
+        assert "gone" not in out
+        assert out["targetMl"] == 77
+
+
+def test_bounded_log_patches_only_new_entries():
+    saved = {"eventLog": [{"t": i, "msg": "x" * 30} for i in range(100)]}
+    live = {"eventLog": deque(saved["eventLog"], maxlen=100)}
+    live["eventLog"].append({"t": 100, "msg": "Target set to 77 ml/plant"})
+    ops = []
+    ss.diff_state(saved, live, [], ops)
+    assert ops == [[["eventLog"], "+", [{"t": 100, "msg": "Target set to 77 ml/plant"}], 100]]
+    assert len(ss._dumps(ops)) < 100
+    for op in ss._loads(ss._dumps(ops)):
+        ss.apply_op(saved, op)
+    assert saved["eventLog"] == list(live["eventLog"])
+
+
+def test_bounded_log_diff_apply_random():
+    import random
+    for seed in range(300):
+        r = random.Random(seed)
+        live = deque(range(r.randint(0, 12)), maxlen=8)
+        saved = list(live)
+        for _ in range(20):
+            c = r.random()
+            if c < 0.6:
+                for _ in range(r.randint(1, 10)):
+                    live.append(r.randint(0, 5))    # repeats make the overlap search work for it
+            elif c < 0.7:
+                live.clear()
+            elif c < 0.8 and live:
+                live.popleft()
+            ops = []
+            ss.diff_state({"l": saved}, {"l": live}, [], ops)
+            st = {"l": saved}
+            for op in ss._loads(ss._dumps(ops)):
+                ss.apply_op(st, op)
+            saved = st["l"]
+            assert saved == list(live), (seed, ops)
+
+
+def test_diff_apply_matches_target():
+    a = {"x": 1, "l": [1, 2, 3, 4], "d": {"1": True, "2": True}}
+    b = {"x": 2, "l": [2, 3, 4, 5], "d": {1: True}, "n": None}
+    ops = []
+    ss.diff_state(a, b, [], ops)
+    out = copy.deepcopy(a)
+    for op in ss._loads(ss._dumps(ops)):
+        ss.apply_op(out, op)
+    assert out == ss._loads(ss._dumps(b))
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            fn()
+            print("ok", name)